@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import math
+import tiktoken
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import Chroma
+from tools import load_documents, split_documents, split_documents_by_tokens, setup_retriever, build_context, overlap_length
+
+JSON_FILE_PATH = os.path.join(os.path.dirname(__file__), "GENZMarketing.json")
+EVAL_SET_PATH = os.path.join(os.path.dirname(__file__), "retrieval_eval_set.json")
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings that run offline.
+
+    Stands in for OpenAIEmbeddings so settings can be compared without API
+    calls. Absolute scores will differ from production, the relative ranking
+    of settings is what the harness is for.
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"[a-z0-9£]+", text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] % 2 == 0 else -1.0
+            vector[index] += sign
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+def load_eval_set(eval_set_path):
+    """Load the labelled question -> expected URL pairs."""
+    with open(eval_set_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def repeated_chars(documents):
+    """Count characters repeated between neighbouring chunks of the same page."""
+    return sum(
+        overlap_length(doc.page_content, other.page_content)
+        for doc in documents
+        for other in documents
+        if doc is not other and doc.metadata.get("url") == other.metadata.get("url")
+    )
+
+def evaluate_setting(vectordb, eval_set, k, encoding, use_mmr=False, max_context_tokens=None):
+    """Run every labelled question against the index and score the results."""
+    hits = 0
+    reciprocal_ranks = []
+    prompt_tokens = []
+    duplicate_chars = []
+    query_times = []
+
+    # Same retriever the chatbot uses, so the measured path matches production
+    retriever = setup_retriever(vectordb, k=k, use_mmr=use_mmr)
+
+    for item in eval_set:
+        expected_urls = set(item["expected_urls"])
+
+        start = time.perf_counter()
+        documents = retriever.get_relevant_documents(item["question"])
+        if max_context_tokens:
+            documents = build_context(documents, max_tokens=max_context_tokens)
+        query_times.append(time.perf_counter() - start)
+
+        urls = [doc.metadata.get("url") for doc in documents]
+        rank = next((i + 1 for i, url in enumerate(urls) if url in expected_urls), None)
+        if rank:
+            hits += 1
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+        # Approximates what the "stuff" chain sends: all chunks plus the query
+        context = "\n\n".join(doc.page_content for doc in documents)
+        prompt_tokens.append(len(encoding.encode(f"{context}\n\nQuery: {item['question']}")))
+        duplicate_chars.append(repeated_chars(documents))
+
+    return {
+        "recall_at_k": hits / len(eval_set),
+        "mrr": sum(reciprocal_ranks) / len(eval_set),
+        "avg_prompt_tokens": sum(prompt_tokens) / len(eval_set),
+        "max_prompt_tokens": max(prompt_tokens),
+        "avg_repeated_chars": sum(duplicate_chars) / len(eval_set),
+        "avg_query_ms": 1000 * sum(query_times) / len(eval_set),
+    }
+
+def run_sweep(json_file_path, eval_set_path, separators, chunk_sizes, chunk_overlaps, ks,
+              token_splitter=False, use_mmr=False, max_context_tokens=None):
+    """Build one index per splitter setting and evaluate it for every k.
+
+    With token_splitter, chunk sizes and overlaps are in tokens and separators are ignored.
+    """
+    documents = load_documents(json_file_path)
+    eval_set = load_eval_set(eval_set_path)
+    embeddings = HashingEmbeddings()
+    encoding = tiktoken.encoding_for_model("gpt-4o")
+    results = []
+
+    if token_splitter:
+        separators = ["tokens"]
+
+    for index, (separator, chunk_size, chunk_overlap) in enumerate(
+        itertools.product(separators, chunk_sizes, chunk_overlaps)
+    ):
+        if chunk_overlap >= chunk_size:
+            continue
+
+        start = time.perf_counter()
+        if token_splitter:
+            docs = split_documents_by_tokens(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        else:
+            docs = split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap, separator=separator)
+        vectordb = Chroma.from_documents(documents=docs, embedding=embeddings, collection_name=f"retrieval_eval_{index}")
+        build_seconds = time.perf_counter() - start
+
+        try:
+            for k in ks:
+                metrics = evaluate_setting(vectordb, eval_set, k, encoding, use_mmr, max_context_tokens)
+                results.append({
+                    "separator": separator,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "k": k,
+                    "num_chunks": len(docs),
+                    "max_chunk_chars": max(len(doc.page_content) for doc in docs),
+                    "build_ms": 1000 * build_seconds,
+                    **metrics,
+                })
+        finally:
+            vectordb.delete_collection()
+
+    return results
+
+def print_report(results):
+    """Print the sweep results as a plain-text table."""
+    header = (
+        f"{'sep':>8} {'size':>6} {'overlap':>7} {'k':>3} {'chunks':>6} {'max_chars':>9} "
+        f"{'recall@k':>8} {'mrr':>6} {'avg_tok':>8} {'max_tok':>8} {'dup_chars':>9} {'build_ms':>9} {'query_ms':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(
+            f"{row['separator']!r:>8} {row['chunk_size']:>6} {row['chunk_overlap']:>7} {row['k']:>3} "
+            f"{row['num_chunks']:>6} {row['max_chunk_chars']:>9} {row['recall_at_k']:>8.3f} {row['mrr']:>6.3f} "
+            f"{row['avg_prompt_tokens']:>8.0f} {row['max_prompt_tokens']:>8} {row['avg_repeated_chars']:>9.1f} {row['build_ms']:>9.1f} {row['avg_query_ms']:>9.2f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and k settings for the retriever offline.")
+    parser.add_argument("--data", default=JSON_FILE_PATH, help="Path to the scraped site JSON.")
+    parser.add_argument("--eval-set", default=EVAL_SET_PATH, help="Path to the labelled question set.")
+    parser.add_argument("--separators", nargs="+", default=["\n", " "], help="Splitter separators to try.")
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[250, 500, 1000, 2000])
+    parser.add_argument("--chunk-overlaps", nargs="+", type=int, default=[0, 40, 100])
+    parser.add_argument("--ks", nargs="+", type=int, default=[1, 3, 5])
+    parser.add_argument("--token-splitter", action="store_true", help="Split by tokens instead of characters.")
+    parser.add_argument("--mmr", action="store_true", help="Retrieve with maximal marginal relevance.")
+    parser.add_argument("--max-context-tokens", type=int, help="Apply the deduplicating context budget.")
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    # argparse passes "\n" through literally, so allow escaped separators on the command line
+    separators = [separator.encode("utf-8").decode("unicode_escape") for separator in args.separators]
+
+    results = run_sweep(
+        args.data, args.eval_set, separators, args.chunk_sizes, args.chunk_overlaps, args.ks,
+        token_splitter=args.token_splitter, use_mmr=args.mmr, max_context_tokens=args.max_context_tokens,
+    )
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,7 @@ def design_retriever(inputs):
         return {"error": "No vector database provided."}
 
     try:
-        retriever = setup_retriever(vector_database)
+        retriever = setup_retriever(vector_database, use_mmr=inputs.get("use_mmr", False))
         return {"retriever": retriever}
     except Exception as e:
         return {"error": f"Retriever design error: {str(e)}"}
@@ -1,16 +1,26 @@
 import os
 import json
 import hashlib
+import tiktoken
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
-from langchain.text_splitter import CharacterTextSplitter
+from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from dotenv import load_dotenv
 
 load_dotenv()
 
+MODEL_NAME = "gpt-4o"
+
+# Chunking and prompt budget settings for the "stuff" chain
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 30
+MAX_CONTEXT_TOKENS = 1500
+DUPLICATE_THRESHOLD = 0.8
+MIN_OVERLAP_CHARS = 20
+
 def compute_file_hash(file_path):
     """Compute a hash for the contents of a file."""
     hasher = hashlib.md5()
@@ -19,6 +29,89 @@ def compute_file_hash(file_path):
         hasher.update(buf)
     return hasher.hexdigest()
 
+def load_documents(json_file_path):
+    """Load the scraped pages from the JSON file as Document objects."""
+    with open(json_file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    return [
+        Document(page_content=item["content"], metadata={"title": item["title"], "url": item["url"]})
+        for item in data
+    ]
+
+def split_documents(documents, chunk_size=1000, chunk_overlap=40, separator="\n"):
+    """Split documents into manageable chunks."""
+    text_splitter = CharacterTextSplitter(separator=separator, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(documents)
+
+def split_documents_by_tokens(documents, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS):
+    """Split documents into chunks measured in model tokens rather than characters."""
+    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name=MODEL_NAME, chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    return text_splitter.split_documents(documents)
+
+def count_tokens(text):
+    """Count the tokens the chat model will see for a piece of text."""
+    return len(tiktoken.encoding_for_model(MODEL_NAME).encode(text))
+
+def _shingles(text, size=3):
+    words = text.lower().split()
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+def is_near_duplicate(text, other, threshold=DUPLICATE_THRESHOLD):
+    """Check whether most of the shorter text is already contained in the other."""
+    shingles, other_shingles = _shingles(text), _shingles(other)
+    smallest = min(len(shingles), len(other_shingles))
+    if not smallest:
+        return False
+    return len(shingles & other_shingles) / smallest >= threshold
+
+def overlap_length(text, other):
+    """Length of the longest suffix of text that is also a prefix of other."""
+    for size in range(min(len(text), len(other)), MIN_OVERLAP_CHARS - 1, -1):
+        if text.endswith(other[:size]):
+            return size
+    return 0
+
+def _trim_overlap(doc, selected):
+    """Cut the text a chunk shares with its already selected neighbours from the same page."""
+    text = doc.page_content
+    for kept in selected:
+        if kept.metadata.get("url") != doc.metadata.get("url"):
+            continue
+        # kept chunk comes right before this one
+        head = overlap_length(kept.page_content, text)
+        if head:
+            text = text[head:]
+        # kept chunk comes right after this one
+        tail = overlap_length(text, kept.page_content)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+def build_context(documents, max_tokens=MAX_CONTEXT_TOKENS, threshold=DUPLICATE_THRESHOLD):
+    """Select retrieved chunks in rank order within a token budget.
+
+    Near-duplicate chunks are skipped and text overlapping a neighbouring chunk
+    from the same page is trimmed. Selection stops at the first chunk that
+    does not fit, so a lower ranked chunk never displaces a higher ranked one.
+    """
+    selected = []
+    used_tokens = 0
+    for doc in documents:
+        if any(is_near_duplicate(doc.page_content, kept.page_content, threshold) for kept in selected):
+            continue
+        text = _trim_overlap(doc, selected)
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if used_tokens + tokens > max_tokens:
+            break
+        selected.append(Document(page_content=text, metadata=doc.metadata))
+        used_tokens += tokens
+    return selected
+
 def create_vector_database(json_file_path):
     """Create a vector database using ChromaDB with OpenAI embeddings."""
     persist_directory = "db"
@@ -26,9 +119,11 @@ def create_vector_database(json_file_path):
     # Initialize OpenAI embeddings
     openai_embeddings = OpenAIEmbeddings()
 
+    # Include the chunking settings so changing them also rebuilds the index
+    new_hash = f"{compute_file_hash(json_file_path)}:tokens-{CHUNK_TOKENS}-{CHUNK_OVERLAP_TOKENS}"
+
     # Check if the database already exists and if the data has changed
     if os.path.exists(persist_directory) and os.path.exists(json_file_path):
-        new_hash = compute_file_hash(json_file_path)
         hash_file = os.path.join(persist_directory, "data_hash.txt")
         if os.path.exists(hash_file):
             with open(hash_file, 'r') as f:
@@ -37,32 +132,34 @@ def create_vector_database(json_file_path):
                 print("No changes detected in data. Using existing embeddings.")
                 return Chroma(persist_directory=persist_directory, embedding_function=openai_embeddings)
 
-    # Load data from the JSON file
-    with open(json_file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+        # Drop the stale collection so old chunks are not mixed with the new ones
+        Chroma(persist_directory=persist_directory, embedding_function=openai_embeddings).delete_collection()
 
-    # Create Document objects from the data
-    documents = [
-        Document(page_content=item["content"], metadata={"title": item["title"], "url": item["url"]})
-        for item in data
-    ]
+    # Load data from the JSON file
+    documents = load_documents(json_file_path)
 
     # Split documents into manageable chunks
-    text_splitter = CharacterTextSplitter(separator="\n", chunk_size=1000, chunk_overlap=40)
-    docs = text_splitter.split_documents(documents)    # Create and persist the Chroma vector database
+    docs = split_documents_by_tokens(documents)
+
+    # Create and persist the Chroma vector database
     vectordb = Chroma.from_documents(documents=docs, embedding=openai_embeddings, persist_directory=persist_directory)
     vectordb.persist()
 
     # Save the new hash of the data
-    new_hash = compute_file_hash(json_file_path)
     with open(os.path.join(persist_directory, "data_hash.txt"), 'w') as f:
         f.write(new_hash)
 
     return vectordb
 
-def setup_retriever(vector_database):
-    """Setup a retriever using the vector database."""
-    return vector_database.as_retriever(search_kwargs={"k": 3})
+def setup_retriever(vector_database, k=6, use_mmr=False, fetch_k=20):
+    """Setup a retriever using the vector database.
+
+    k is the number of candidate chunks; build_context trims them to the token budget.
+    With use_mmr, chunks are picked from the top fetch_k by maximal marginal relevance.
+    """
+    if use_mmr:
+        return vector_database.as_retriever(search_type="mmr", search_kwargs={"k": k, "fetch_k": fetch_k})
+    return vector_database.as_retriever(search_kwargs={"k": k})
 
 def build_chatbot(retriever):
     """Build a chatbot using OpenAI's GPT-4o model."""
@@ -73,12 +170,12 @@ def build_chatbot(retriever):
 
     # Initialize the ChatOpenAI model
     llm = ChatOpenAI(
-        model="gpt-4o", 
+        model=MODEL_NAME,
         temperature=0
     )
 
-    # Create a RetrievalQA chain
-    qa_chain = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
+    # Create a "stuff" QA chain; the context is assembled per query by build_context
+    qa_chain = load_qa_chain(llm=llm, chain_type="stuff")
 
     def answer_with_sources(query):
         # Define a dynamic prompt
@@ -90,9 +187,16 @@ def build_chatbot(retriever):
         )
         full_query = f"{dynamic_prompt}\n\nQuery: {query}"
 
+        # Retrieve once, then keep only the chunks that fit the prompt budget
+        candidates = retriever.get_relevant_documents(query)
+        documents = build_context(candidates)
+
+        context = "\n\n".join(doc.page_content for doc in documents)
+        prompt_tokens = count_tokens(qa_chain.llm_chain.prompt.format(context=context, question=full_query))
+        print(f"Prompt size: {prompt_tokens} tokens ({len(documents)} of {len(candidates)} retrieved chunks)")
+
         # Get the response from the QA chain
-        response = qa_chain.run(full_query)
-        documents = retriever.get_relevant_documents(query)
+        response = qa_chain.run(input_documents=documents, question=full_query)
 
         # Extract source URLs from the retrieved documents
         all_urls = [doc.metadata.get("url", "No URL provided") for doc in documents]